@@ -57,12 +57,21 @@
 
 
 import socket
+import ssl
 import threading
+import queue
+import bisect
+from collections import OrderedDict, deque, namedtuple
 import sys
 import os
 import sqlalchemy
 import shutil
 import time
+import hashlib
+import base64
+import hmac
+import secrets
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import create_engine, Column, String, Integer, LargeBinary
 from sqlalchemy.orm import declarative_base, sessionmaker
 from PyQt6.QtWidgets import (
@@ -70,7 +79,7 @@ from PyQt6.QtWidgets import (
     QLineEdit, QPushButton, QListWidget, QTextEdit, QStackedWidget,
     QFileDialog, QMessageBox, QDialog, QFormLayout, QListWidgetItem
 )
-from PyQt6.QtCore import Qt, QSize, QThread, pyqtSignal
+from PyQt6.QtCore import Qt, QSize, QThread, QTimer, pyqtSignal
 from PyQt6.QtGui import QPixmap, QImage, QIcon, QFont
 
 Base = declarative_base()
@@ -106,67 +115,1040 @@ engine = create_engine('sqlite:///messenger.db')
 Base.metadata.create_all(engine)
 Session = sessionmaker(bind=engine)
 
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+HASH_WORKERS = 2
+SESSION_TTL = 24 * 60 * 60
+SESSION_SECRET = os.environ.get('MESSENGER_SECRET', '').encode() or secrets.token_bytes(32)
+
+DIRECTORY_CACHE_SIZE = 1024
+SEARCH_LIMIT = 10
+
+PASSWORD_POOL = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='password')
+
+
+# ====================== PASSWORDS ======================
+def hash_password(password):
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password, stored):
+    try:
+        scheme, n, r, p, salt, digest = stored.split('$')
+    except (AttributeError, ValueError):
+        return False
+    if scheme != 'scrypt':
+        return False
+
+    candidate = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p))
+    return hmac.compare_digest(candidate.hex(), digest)
+
+
+# Unknown usernames are checked against this so they cost as much as known ones
+DUMMY_PASSWORD_HASH = hash_password(secrets.token_urlsafe(16))
+
+
+def authenticate(username, password):
+    # Runs on PASSWORD_POOL, which caps how many slow hashes the server computes at once
+    session = Session()
+    try:
+        user = session.query(User).filter_by(username=username).first()
+        stored = user.password if user is not None else DUMMY_PASSWORD_HASH
+        if verify_password(password, stored) and user is not None:
+            return user.id
+        return None
+    finally:
+        session.close()
+
+
+def migrate_passwords():
+    session = Session()
+    for user in session.query(User).filter(~User.password.startswith('scrypt$')):
+        user.password = hash_password(user.password)
+    session.commit()
+    session.close()
+
+
+def sign_token(payload, password_hash):
+    # The password hash is part of the MAC, so a password change revokes every earlier token
+    return hmac.new(SESSION_SECRET, f"{payload}.{password_hash}".encode(), hashlib.sha256).hexdigest()
+
+
+def issue_token(user_id, password_hash):
+    # user_id.expires.signature, issued by the server after a password login
+    payload = f"{user_id}.{int(time.time()) + SESSION_TTL}"
+    return f"{payload}.{sign_token(payload, password_hash)}"
+
+
+def verify_token(token):
+    try:
+        user_id, expires, signature = token.split('.')
+    except ValueError:
+        return None
+    if not (token.isascii() and user_id.isdigit() and expires.isdigit()) or int(expires) < time.time():
+        return None
+
+    session = Session()
+    try:
+        user = session.get(User, int(user_id))
+    finally:
+        session.close()
+    if user is None:
+        return None
+
+    expected = sign_token(f"{user_id}.{expires}", user.password)
+    if not hmac.compare_digest(signature.encode(), expected.encode()):
+        return None
+    return user.id
+
+
+# ====================== USER DIRECTORY ======================
+UserEntry = namedtuple('UserEntry', ['id', 'username', 'phone', 'profile_pic'])
+
+
+class UserDirectory:
+    # Exact and prefix lookups go through in-memory username/phone indexes;
+    # full rows sit in an LRU that is invalidated whenever a profile changes.
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.keys = None
+        self.by_username = {}
+        self.by_phone = {}
+        self.usernames = []
+        self.phones = []
+
+    def load_index(self):
+        if self.keys is not None:
+            return
+        session = Session()
+        rows = session.query(User.id, User.username, User.phone).all()
+        session.close()
+
+        self.keys = {}
+        for user_id, username, phone in rows:
+            self.index(user_id, username, phone)
+
+    def index(self, user_id, username, phone):
+        self.keys[user_id] = (username, phone)
+        if username:
+            self.by_username[username] = user_id
+            bisect.insort(self.usernames, (username.lower(), user_id))
+        if phone:
+            self.by_phone[phone] = user_id
+            bisect.insort(self.phones, (phone, user_id))
+
+    def unindex(self, user_id):
+        username, phone = self.keys.pop(user_id, (None, None))
+        if username:
+            self.by_username.pop(username, None)
+            self.remove_key(self.usernames, (username.lower(), user_id))
+        if phone:
+            self.by_phone.pop(phone, None)
+            self.remove_key(self.phones, (phone, user_id))
+
+    @staticmethod
+    def remove_key(keys, item):
+        i = bisect.bisect_left(keys, item)
+        if i < len(keys) and keys[i] == item:
+            del keys[i]
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.cache.get(user_id)
+            if entry is not None:
+                self.cache.move_to_end(user_id)
+                return entry
+
+        session = Session()
+        user = session.query(User).get(user_id)
+        session.close()
+        if user is None:
+            return None
+
+        entry = UserEntry(user.id, user.username, user.phone, user.profile_pic)
+        with self.lock:
+            self.cache[user_id] = entry
+            if len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)
+        return entry
+
+    def find(self, username=None, phone=None):
+        with self.lock:
+            self.load_index()
+            if username:
+                user_id = self.by_username.get(username)
+            else:
+                user_id = self.by_phone.get(phone)
+        return self.get(user_id) if user_id is not None else None
+
+    def search(self, prefix, limit=SEARCH_LIMIT):
+        # Returns (id, username, phone) straight from the indexes, no database access
+        results = []
+        with self.lock:
+            self.load_index()
+            for keys, key in ((self.usernames, prefix.lower()), (self.phones, prefix)):
+                i = bisect.bisect_left(keys, (key,))
+                while i < len(keys) and keys[i][0].startswith(key) and len(results) < limit:
+                    user_id = keys[i][1]
+                    if all(user_id != r[0] for r in results):
+                        results.append((user_id, *self.keys[user_id]))
+                    i += 1
+        return results
+
+    def update(self, user):
+        with self.lock:
+            self.load_index()
+            self.unindex(user.id)
+            self.index(user.id, user.username, user.phone)
+            self.cache.pop(user.id, None)
+
+
+migrate_passwords()
+DIRECTORY = UserDirectory(DIRECTORY_CACHE_SIZE)
+
 HOST = '127.0.0.1'
 PORT = 65432
 
+PRESENCE_INTERVAL = 1.0
+TYPING_INTERVAL = 3.0
+RECEIPT_INTERVAL = 0.5
+
+RATE_LIMIT = 20
+RATE_BURST = 40
+INBOUND_QUEUE_SIZE = 100
+MAX_FRAME_SIZE = 64 * 1024
+OUTBOUND_QUEUE_SIZE = 500
+PERSIST_QUEUE_SIZE = 1000
+PERSIST_BATCH = 100
+BUSY_RETRY_DELAY = 1
+RECENT_MESSAGE_KEYS = 100
+MESSAGE_TYPES = ('text', 'file', 'sticker', 'voice')
+
+HANDSHAKE_TIMEOUT = 10
+RESUME_WINDOW = 60
+RESUME_BUFFER = 200
+RECONNECT_DELAY = 2
+
+TLS_CERTFILE = os.environ.get('MESSENGER_TLS_CERT')
+TLS_KEYFILE = os.environ.get('MESSENGER_TLS_KEY')
+TLS_CAFILE = os.environ.get('MESSENGER_TLS_CA')
+TLS_CIPHERS = os.environ.get('MESSENGER_TLS_CIPHERS', 'ECDHE+AESGCM:ECDHE+CHACHA20')
+TLS_MIN_VERSION = os.environ.get('MESSENGER_TLS_MIN_VERSION', 'TLSv1_2')
+TLS_MAX_VERSION = os.environ.get('MESSENGER_TLS_MAX_VERSION', 'MAXIMUM_SUPPORTED')
+
+
+# ====================== TLS ======================
+def apply_tls_policy(context):
+    # set_ciphers only covers TLS 1.2 suites; TLS 1.3 uses OpenSSL's defaults
+    # unless MESSENGER_TLS_MAX_VERSION is set to TLSv1_2
+    context.minimum_version = ssl.TLSVersion[TLS_MIN_VERSION]
+    context.maximum_version = ssl.TLSVersion[TLS_MAX_VERSION]
+    context.set_ciphers(TLS_CIPHERS)
+
+
+def make_server_context():
+    if not TLS_CERTFILE:
+        return None
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    apply_tls_policy(context)
+    context.load_cert_chain(TLS_CERTFILE, TLS_KEYFILE)
+    return context
+
+
+def make_client_context():
+    cafile = TLS_CAFILE or TLS_CERTFILE
+    if not cafile:
+        return None
+    context = ssl.create_default_context(cafile=cafile)
+    apply_tls_policy(context)
+    return context
+
+
+def benchmark_tls_reconnect(rounds=200):
+    server_context = make_server_context()
+    client_context = make_client_context()
+    if server_context is None or client_context is None:
+        print("Set MESSENGER_TLS_CERT and MESSENGER_TLS_KEY to run the TLS benchmark")
+        return
+
+    listener = socket.create_server((HOST, 0))
+    port = listener.getsockname()[1]
+
+    def serve():
+        while True:
+            conn, _ = listener.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                with server_context.wrap_socket(conn, server_side=True) as tls_conn:
+                    tls_conn.sendall(b"OK\n")
+                    tls_conn.recv(1)
+            except OSError:
+                pass
+
+    threading.Thread(target=serve, daemon=True).start()
+
+    def reconnect(session):
+        raw = socket.create_connection((HOST, port))
+        raw.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        start = time.perf_counter()
+        tls_sock = client_context.wrap_socket(raw, server_hostname=HOST, session=session)
+        tls_sock.recv(3)
+        elapsed = time.perf_counter() - start
+        reused = tls_sock.session_reused
+        session = tls_sock.session
+        tls_sock.close()
+        return elapsed, reused, session
+
+    _, _, session = reconnect(None)
+    for label, resume in (("full handshake", False), ("resumed", True)):
+        total = 0
+        reused_count = 0
+        for _ in range(rounds):
+            elapsed, reused, new_session = reconnect(session if resume else None)
+            total += elapsed
+            reused_count += reused
+            if resume:
+                session = new_session
+        print(f"{label}: {total / rounds * 1000:.3f} ms per reconnect ({reused_count}/{rounds} resumed)")
+
 
 # ====================== SOCKET SERVER ======================
+class EventCoalescer:
+    # Presence, typing and read receipts are ephemeral: they are never
+    # written to the database and are merged before they hit the wire.
+    def __init__(self, server):
+        self.server = server
+        self.lock = threading.Lock()
+        self.watchers = {}
+        self.pending_presence = {}
+        self.last_presence = {}
+        self.last_typing = {}
+        self.pending_receipts = {}
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+
+    def watch(self, user_id):
+        session = Session()
+        watchers = {row[0] for row in session.query(Contact.user_id).filter_by(contact_id=user_id)}
+        contacts = {row[0] for row in session.query(Contact.contact_id).filter_by(user_id=user_id)}
+        session.close()
+
+        with self.lock:
+            self.watchers[user_id] = watchers
+            online = [c for c in contacts if self.last_presence.get(c) == 'online']
+
+        self.server.send_lines(user_id, [f"{c}:{user_id}:presence:online" for c in online])
+
+    def add_watcher(self, user_id, watcher_id):
+        session = Session()
+        exists = session.query(Contact).filter_by(user_id=watcher_id, contact_id=user_id).first() is not None
+        session.close()
+        if not exists:
+            return
+
+        with self.lock:
+            self.watchers.setdefault(user_id, set()).add(watcher_id)
+            online = self.last_presence.get(user_id) == 'online'
+
+        if online:
+            self.server.send_lines(watcher_id, [f"{user_id}:{watcher_id}:presence:online"])
+
+    def set_presence(self, user_id, state):
+        with self.lock:
+            self.pending_presence[user_id] = state
+
+    def typing(self, sender_id, receiver_id, state):
+        key = (sender_id, receiver_id)
+        now = time.monotonic()
+        with self.lock:
+            if state == 'stop':
+                return self.last_typing.pop(key, None) is not None
+            if now - self.last_typing.get(key, 0) < TYPING_INTERVAL:
+                return False
+            self.last_typing[key] = now
+            return True
+
+    def read(self, reader_id, sender_id, message_id):
+        key = (reader_id, sender_id)
+        with self.lock:
+            if message_id > self.pending_receipts.get(key, 0):
+                self.pending_receipts[key] = message_id
+
+    def flush_presence(self):
+        outgoing = {}
+        with self.lock:
+            pending, self.pending_presence = self.pending_presence, {}
+            for user_id, state in pending.items():
+                if self.last_presence.get(user_id) == state:
+                    continue
+                self.last_presence[user_id] = state
+                for watcher_id in self.watchers.get(user_id, ()):
+                    outgoing.setdefault(watcher_id, []).append(f"{user_id}:{watcher_id}:presence:{state}")
+
+        for receiver_id, lines in outgoing.items():
+            self.server.send_lines(receiver_id, lines)
+
+    def flush_receipts(self):
+        outgoing = {}
+        with self.lock:
+            pending, self.pending_receipts = self.pending_receipts, {}
+        for (reader_id, sender_id), message_id in pending.items():
+            outgoing.setdefault(sender_id, []).append(f"{reader_id}:{sender_id}:read:{message_id}")
+
+        for receiver_id, lines in outgoing.items():
+            self.server.send_lines(receiver_id, lines)
+
+    def run(self):
+        next_presence = time.monotonic()
+        while True:
+            time.sleep(RECEIPT_INTERVAL)
+            self.flush_receipts()
+            if time.monotonic() >= next_presence:
+                self.flush_presence()
+                next_presence = time.monotonic() + PRESENCE_INTERVAL
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self):
+        # Returns how long the caller has to wait before its frame is allowed
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class ResumableSession:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.resume_id = secrets.token_urlsafe(16)
+        self.pending = deque(maxlen=RESUME_BUFFER)
+        self.detached_at = None
+
+    def resumable(self, resume_id):
+        return (
+            self.detached_at is not None
+            and hmac.compare_digest(resume_id.encode(), self.resume_id.encode())
+            and time.monotonic() - self.detached_at < RESUME_WINDOW
+        )
+
+
 class MessengerServer:
     def __init__(self):
         self.clients = {}
+        self.outbound = {}
+        self.send_locks = {}
+        self.sessions = {}
+        self.buckets = {}
+        self.recent_keys = {}
+        self.recent_lock = threading.Lock()
+        self.tls_context = make_server_context()
+        self.events = EventCoalescer(self)
+        self.persist_queue = queue.Queue(maxsize=PERSIST_QUEUE_SIZE)
+        persist_thread = threading.Thread(target=self.persist_messages, daemon=True)
+        persist_thread.start()
+        prune_thread = threading.Thread(target=self.prune_sessions, daemon=True)
+        prune_thread.start()
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.bind((HOST, PORT))
         self.server_socket.listen()
         print(f"Server listening on {HOST}:{PORT}")
 
-    def handle_client(self, client_socket, address):
-        user_id = None
+    def send_flow(self, user_id, state):
+        self.send_lines(user_id, [f"0:{user_id}:flow:{state}"])
+
+    def send_lines(self, receiver_id, lines):
+        send_lock = self.send_locks.get(receiver_id)
+        if send_lock is None or not lines:
+            return
+
+        with send_lock:
+            outbound = self.outbound.get(receiver_id)
+            if outbound is None:
+                # Keep frames for a detached session so a quick reconnect loses nothing
+                session = self.sessions.get(receiver_id)
+                if session and session.detached_at is not None:
+                    session.pending.extend(lines)
+                return
+
+            try:
+                outbound.put_nowait(''.join(line + '\n' for line in lines).encode())
+                return
+            except queue.Full:
+                # The receiver stopped reading; detach it instead of blocking the caller
+                client_socket = self.clients[receiver_id]
+                self.detach(receiver_id, client_socket)
+                self.sessions[receiver_id].pending.extend(lines)
+
+        print(f"Error: user {receiver_id} is not reading, dropping the connection")
+        self.events.set_presence(receiver_id, 'offline')
+        try:
+            client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def detach(self, user_id, client_socket):
+        # Caller holds the user's send lock
+        if self.clients.get(user_id) is not client_socket:
+            return False
+        del self.clients[user_id]
+        outbound = self.outbound.pop(user_id)
+        # Frames still queued for this socket are dropped; the writer stops at None
         while True:
             try:
-                data = client_socket.recv(1024)
-                if not data:
-                    break
+                outbound.put_nowait(None)
+                break
+            except queue.Full:
+                try:
+                    outbound.get_nowait()
+                except queue.Empty:
+                    pass
+        self.sessions[user_id].detached_at = time.monotonic()
+        return True
+
+    def prune_sessions(self):
+        # Sessions past the resume window can't be picked up again; drop them
+        # with the user's rate bucket and message keys
+        while True:
+            time.sleep(RESUME_WINDOW)
+            now = time.monotonic()
+            for user_id, session in list(self.sessions.items()):
+                with self.send_locks[user_id]:
+                    if self.sessions.get(user_id) is not session or session.detached_at is None:
+                        continue
+                    if now - session.detached_at < RESUME_WINDOW:
+                        continue
+                    del self.sessions[user_id]
+                    self.buckets.pop(user_id, None)
+                with self.recent_lock:
+                    self.recent_keys.pop(user_id, None)
+
+    def write_frames(self, client_socket, outbound):
+        while True:
+            data = outbound.get()
+            if data is None:
+                break
+            try:
+                client_socket.sendall(data)
+            except Exception as e:
+                print(f"Error: {e}")
+                break
 
-                parts = data.decode().split(':', 3)
-                if len(parts) < 4:
-                    continue
+    def handle_frame(self, user_id, line):
+        parts = line.split(':', 3)
+        if len(parts) < 4:
+            return
 
-                sender_id, receiver_id, msg_type, content = parts
-                sender_id = int(sender_id)
-                receiver_id = int(receiver_id)
+        sender_id, receiver_id, msg_type, content = parts
+        sender_id = int(sender_id)
+        receiver_id = int(receiver_id)
 
-                session = Session()
-                new_message = Message(
+        if sender_id != user_id:
+            return
+
+        if msg_type == 'typing':
+            if self.events.typing(sender_id, receiver_id, content):
+                self.send_lines(receiver_id, [line])
+            return
+
+        if msg_type == 'read':
+            self.events.read(sender_id, receiver_id, int(content))
+            return
+
+        if msg_type == 'contact':
+            self.events.add_watcher(receiver_id, sender_id)
+            return
+
+        if msg_type == 'password':
+            self.refresh_token(sender_id, content)
+            return
+
+        if msg_type not in MESSAGE_TYPES:
+            return
+
+        # Messages carry a client-chosen key so a resend after a reconnect is stored once
+        key, _, content = content.partition(':')
+        if not key or len(key) > 32:
+            return
+
+        with self.recent_lock:
+            recent = self.recent_keys.setdefault(sender_id, OrderedDict())
+            duplicate = key in recent
+            message_id = recent.get(key)
+            if not duplicate:
+                recent[key] = None
+                if len(recent) > RECENT_MESSAGE_KEYS:
+                    recent.popitem(last=False)
+
+        if duplicate:
+            # Still queued: its ack is on the way; already stored: ack it again
+            if message_id is not None:
+                self.send_lines(sender_id, [f"{receiver_id}:{sender_id}:stored:{key}:{message_id}"])
+            return
+
+        try:
+            self.persist_queue.put_nowait((sender_id, receiver_id, msg_type, key, content))
+        except queue.Full:
+            # Admission control: the writer is behind, make the sender retry
+            with self.recent_lock:
+                self.recent_keys.get(sender_id, {}).pop(key, None)
+            self.send_lines(sender_id, [f"{receiver_id}:{sender_id}:busy:{key}"])
+
+    def store_messages(self, batch):
+        session = Session()
+        try:
+            messages = [
+                Message(
                     sender_id=sender_id,
                     receiver_id=receiver_id,
                     content=content,
                     file_type=msg_type if msg_type != 'text' else None
                 )
-                session.add(new_message)
-                session.commit()
+                for sender_id, receiver_id, msg_type, key, content in batch
+            ]
+            session.add_all(messages)
+            session.flush()
+            message_ids = [message.id for message in messages]
+            session.commit()
+            return message_ids
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def persist_messages(self):
+        while True:
+            batch = [self.persist_queue.get()]
+            while len(batch) < PERSIST_BATCH:
+                try:
+                    batch.append(self.persist_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                message_ids = self.store_messages(batch)
+            except Exception as e:
+                print(f"Error: batch of {len(batch)} messages failed, retrying one by one: {e}")
+                message_ids = []
+                for item in batch:
+                    try:
+                        message_ids.extend(self.store_messages([item]))
+                    except Exception as e:
+                        print(f"Error: message from {item[0]} to {item[1]} lost: {e}")
+                        message_ids.append(None)
+
+            # Messages are relayed only once they are stored, so a failed
+            # write is never seen by the receiver
+            for (sender_id, receiver_id, msg_type, key, content), message_id in zip(batch, message_ids):
+                with self.recent_lock:
+                    recent = self.recent_keys.get(sender_id, {})
+                    if message_id is None:
+                        recent.pop(key, None)
+                    elif key in recent:
+                        recent[key] = message_id
+
+                if message_id is None:
+                    self.send_lines(sender_id, [f"{receiver_id}:{sender_id}:failed:{key}:{msg_type}"])
+                    continue
+                self.send_lines(sender_id, [f"{receiver_id}:{sender_id}:stored:{key}:{message_id}"])
+                self.send_lines(receiver_id, [f"{sender_id}:{receiver_id}:{msg_type}:{message_id}:{content}"])
+
+    def dispatch_frames(self, user_id, inbound, paused):
+        bucket = self.buckets.setdefault(user_id, TokenBucket(RATE_LIMIT, RATE_BURST))
+        while True:
+            line = inbound.get()
+            if line is None:
+                break
+
+            wait = bucket.consume()
+            while wait:
+                time.sleep(wait)
+                wait = bucket.consume()
+
+            try:
+                self.handle_frame(user_id, line)
+            except Exception as e:
+                print(f"Error: {e}")
+
+            if paused.is_set() and inbound.qsize() <= INBOUND_QUEUE_SIZE // 4:
+                paused.clear()
+                self.send_flow(user_id, 'resume')
 
-                if receiver_id in self.clients:
-                    self.clients[receiver_id].sendall(data)
+    def login(self, username, password):
+        try:
+            username = base64.b64decode(username, validate=True).decode()
+            password = base64.b64decode(password, validate=True).decode()
+        except ValueError:
+            return None
+        return PASSWORD_POOL.submit(authenticate, username, password).result()
+
+    def user_token(self, user_id):
+        session = Session()
+        try:
+            user = session.get(User, user_id)
+        finally:
+            session.close()
+        return issue_token(user.id, user.password)
+
+    def refresh_token(self, user_id, password):
+        # Sent by the client after a password change; the new password proves
+        # the request, and the old token stops verifying on its own
+        try:
+            password = base64.b64decode(password, validate=True).decode()
+        except ValueError:
+            return
+        session = Session()
+        try:
+            user = session.get(User, user_id)
+        finally:
+            session.close()
+        if user is None or not PASSWORD_POOL.submit(verify_password, password, user.password).result():
+            return
+        self.send_lines(user_id, [f"0:{user_id}:token:{issue_token(user.id, user.password)}"])
+
+    def handshake(self, client_socket):
+        # One round trip: "HELLO <token> [<resume_id>]", or "LOGIN <username> <password>"
+        # in base64 -> "OK <resume_id> <token>" + missed frames
+        client_socket.settimeout(HANDSHAKE_TIMEOUT)
+        buffer = b''
+        while b'\n' not in buffer:
+            data = client_socket.recv(1024)
+            if not data or len(buffer) > 4096:
+                return None, False, b'', None
+            buffer += data
+        client_socket.settimeout(None)
+
+        line, buffer = buffer.split(b'\n', 1)
+        parts = line.decode().split()
+        user_id = None
+        if len(parts) in (2, 3) and parts[0] == 'HELLO':
+            user_id = verify_token(parts[1])
+        elif len(parts) == 3 and parts[0] == 'LOGIN':
+            user_id = self.login(parts[1], parts[2])
+        if user_id is None:
+            client_socket.sendall(b"DENIED\n")
+            return None, False, b'', None
+
+        token = self.user_token(user_id)
+        send_lock = self.send_locks.setdefault(user_id, threading.Lock())
+        with send_lock:
+            session = self.sessions.get(user_id)
+            resumed = (
+                session is not None
+                and parts[0] == 'HELLO'
+                and len(parts) == 3
+                and session.resumable(parts[2])
+            )
+            if not resumed:
+                session = ResumableSession(user_id)
+                self.sessions[user_id] = session
+
+            lines = [f"OK {session.resume_id} {token}"] + list(session.pending)
+            session.pending.clear()
+            session.detached_at = None
+            outbound = queue.Queue(maxsize=OUTBOUND_QUEUE_SIZE)
+            outbound.put_nowait(''.join(line + '\n' for line in lines).encode())
+            self.clients[user_id] = client_socket
+            self.outbound[user_id] = outbound
+
+        writer = threading.Thread(
+            target=self.write_frames,
+            args=(client_socket, outbound),
+            daemon=True
+        )
+        writer.start()
+        return user_id, resumed, buffer, writer
+
+    def handle_client(self, client_socket, address):
+        try:
+            if self.tls_context is not None:
+                # TLS handshake runs here, not in accept(), so slow clients can't stall others
+                client_socket.settimeout(HANDSHAKE_TIMEOUT)
+                client_socket = self.tls_context.wrap_socket(client_socket, server_side=True)
+            user_id, resumed, buffer, writer = self.handshake(client_socket)
+        except Exception as e:
+            print(f"Error: {e}")
+            user_id = None
+
+        if user_id is None:
+            client_socket.close()
+            return
+
+        if not resumed:
+            self.events.watch(user_id)
+        self.events.set_presence(user_id, 'online')
+
+        inbound = queue.Queue(maxsize=INBOUND_QUEUE_SIZE)
+        paused = threading.Event()
+        dispatcher = threading.Thread(
+            target=self.dispatch_frames,
+            args=(user_id, inbound, paused)
+        )
+        dispatcher.start()
+
+        while True:
+            try:
+                while b'\n' in buffer:
+                    line, buffer = buffer.split(b'\n', 1)
+                    if inbound.full() and not paused.is_set():
+                        paused.set()
+                        self.send_flow(user_id, 'pause')
+                    # Blocks while full, which stops reading and lets TCP push back
+                    inbound.put(line.decode())
+
+                if len(buffer) > MAX_FRAME_SIZE:
+                    print(f"Error: frame from user {user_id} exceeds {MAX_FRAME_SIZE} bytes")
+                    break
+
+                data = client_socket.recv(1024)
+                if not data:
+                    break
+                buffer += data
 
             except Exception as e:
                 print(f"Error: {e}")
                 break
 
-        if user_id in self.clients:
-            del self.clients[user_id]
+        inbound.put(None)
+        with self.send_locks[user_id]:
+            detached = self.detach(user_id, client_socket)
+        if detached:
+            self.events.set_presence(user_id, 'offline')
+        # Unblock the writer before closing the socket it is using
+        try:
+            client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        writer.join()
         client_socket.close()
 
     def start(self):
         while True:
             client_socket, address = self.server_socket.accept()
-            user_id = int(client_socket.recv(1024).decode())
-            self.clients[user_id] = client_socket
             thread = threading.Thread(
                 target=self.handle_client,
                 args=(client_socket, address)
             )
             thread.start()
 
+
+class ClientThread(QThread):
+    frame_received = pyqtSignal(int, str, str)
+    logged_in = pyqtSignal(int)
+    login_failed = pyqtSignal(str)
+    session_rejected = pyqtSignal()
+
+    def __init__(self, username, password):
+        super().__init__()
+        self.username = username
+        self.password = password
+        self.user_id = None
+        self.token = None
+        self.resume_id = None
+        self.tls_context = make_client_context()
+        self.tls_session = None
+        self.socket = None
+        self.paused = False
+        self.outbox = OrderedDict()
+        self.in_flight = None
+        self.outbox_lock = threading.Lock()
+        self.send_lock = threading.Lock()
+
+    def connect_to_server(self):
+        # Returns (socket, leftover bytes), or (None, None) if the server denied the login or token.
+        # The password is only sent until the server has issued a token.
+        if self.token is None:
+            username = base64.b64encode(self.username.encode()).decode()
+            password = base64.b64encode(self.password.encode()).decode()
+            hello = f"LOGIN {username} {password}"
+        elif self.resume_id:
+            hello = f"HELLO {self.token} {self.resume_id}"
+        else:
+            hello = f"HELLO {self.token}"
+        client_socket = socket.create_connection((HOST, PORT), timeout=HANDSHAKE_TIMEOUT)
+        try:
+            if self.tls_context is not None:
+                # Offering the previous session lets the server skip the full key exchange
+                client_socket = self.tls_context.wrap_socket(
+                    client_socket, server_hostname=HOST, session=self.tls_session
+                )
+            client_socket.sendall(f"{hello}\n".encode())
+
+            buffer = b''
+            while b'\n' not in buffer:
+                data = client_socket.recv(1024)
+                if not data:
+                    raise ConnectionError("server closed the connection during handshake")
+                buffer += data
+
+            line, buffer = buffer.split(b'\n', 1)
+            parts = line.decode().split()
+            if len(parts) != 3 or parts[0] != 'OK':
+                client_socket.close()
+                return None, None
+
+            self.resume_id, self.token = parts[1], parts[2]
+            if self.tls_context is not None:
+                self.tls_session = client_socket.session
+            client_socket.settimeout(None)
+            return client_socket, buffer
+        except Exception:
+            client_socket.close()
+            raise
+
+    def run(self):
+        while not self.isInterruptionRequested():
+            client_socket = None
+            try:
+                client_socket, buffer = self.connect_to_server()
+                if client_socket is None:
+                    if self.user_id is None:
+                        self.login_failed.emit("Invalid credentials")
+                    else:
+                        print("Error: session rejected by server")
+                        self.session_rejected.emit()
+                    break
+
+                if self.user_id is None:
+                    self.password = None
+                    self.user_id = int(self.token.split('.')[0])
+                    self.logged_in.emit(self.user_id)
+
+                self.socket = client_socket
+                self.frame_received.emit(0, 'flow', 'connected')
+                with self.outbox_lock:
+                    self.in_flight = None
+                # Acks replayed from the resume buffer settle the outbox before anything is resent
+                buffer = self.process_frames(buffer)
+                self.flush_outbox()
+                self.read_frames(buffer)
+            except (OSError, ValueError) as e:
+                print(f"Error: {e}")
+            finally:
+                self.socket = None
+                self.paused = False
+                if client_socket is not None:
+                    client_socket.close()
+
+            if self.user_id is None:
+                self.login_failed.emit("Could not reach the server")
+                break
+
+            self.frame_received.emit(0, 'flow', 'disconnected')
+            if not self.isInterruptionRequested():
+                time.sleep(RECONNECT_DELAY)
+
+    def process_frames(self, buffer):
+        # Handles every complete line and returns the unfinished tail
+        while b'\n' in buffer:
+            line, buffer = buffer.split(b'\n', 1)
+            parts = line.decode().split(':', 3)
+            if len(parts) < 4:
+                continue
+            if parts[2] == 'token':
+                # Re-issued after a password change; kept for the next reconnect
+                self.token = parts[3]
+                continue
+            if parts[2] == 'flow':
+                self.handle_flow(parts[3])
+            elif parts[2] in ('stored', 'failed'):
+                self.message_done(parts[3].split(':', 1)[0])
+            elif parts[2] == 'busy':
+                self.message_busy(parts[3])
+            self.frame_received.emit(int(parts[0]), parts[2], parts[3])
+        return buffer
+
+    def read_frames(self, buffer):
+        while True:
+            buffer = self.process_frames(buffer)
+
+            try:
+                data = self.socket.recv(1024)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+
+    def stop(self):
+        self.requestInterruption()
+        if self.socket is not None:
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.wait()
+
+    def send_message(self, receiver_id, msg_type, content):
+        with self.outbox_lock:
+            self.outbox[secrets.token_hex(8)] = (receiver_id, msg_type, content)
+        self.flush_outbox()
+
+    def flush_outbox(self):
+        # One message in flight at a time; stored/failed/busy replies echo its
+        # key, so a late or replayed reply can't settle a different message
+        with self.outbox_lock:
+            if self.in_flight or self.paused or self.socket is None or not self.outbox:
+                return
+            key, (receiver_id, msg_type, content) = next(iter(self.outbox.items()))
+            self.in_flight = key
+        self.send_frame(receiver_id, msg_type, f"{key}:{content}")
+
+    def message_done(self, key):
+        with self.outbox_lock:
+            self.outbox.pop(key, None)
+            if self.in_flight == key:
+                self.in_flight = None
+        self.flush_outbox()
+
+    def message_busy(self, key):
+        with self.outbox_lock:
+            if self.in_flight != key:
+                return
+            self.in_flight = None
+        timer = threading.Timer(BUSY_RETRY_DELAY, self.flush_outbox)
+        timer.daemon = True
+        timer.start()
+
+    def handle_flow(self, state):
+        if state in ('pause', 'resume'):
+            self.paused = state == 'pause'
+            if not self.paused:
+                self.flush_outbox()
+
+    def change_password(self, password):
+        self.send_frame(0, 'password', base64.b64encode(password.encode()).decode())
+
+    def send_frame(self, receiver_id, msg_type, content):
+        if self.paused and msg_type == 'typing':
+            return
+        # Called from the GUI, the reader and retry timers; one frame on the wire at a time
+        with self.send_lock:
+            client_socket = self.socket
+            if client_socket is None:
+                return
+            try:
+                client_socket.sendall(f"{self.user_id}:{receiver_id}:{msg_type}:{content}\n".encode())
+            except OSError as e:
+                print(f"Error: {e}")
+
+
             # ====================== CLIENT GUI ======================
 
 
@@ -220,19 +1202,30 @@ class LoginWindow(QWidget):
             QMessageBox.warning(self, "Error", "Please fill all fields")
             return
 
+        self.login_btn.setEnabled(False)
+        # The server checks the password and issues the session token
+        client = ClientThread(username, password)
+        client.logged_in.connect(self.finish_login)
+        client.login_failed.connect(self.show_login_error)
+        self.stacked_widget.main_window.connect_to_server(client)
+
+    def finish_login(self, user_id):
+        self.login_btn.setEnabled(True)
+
         session = Session()
-        user = session.query(User).filter_by(username=username, password=password).first()
+        user = session.query(User).get(user_id)
 
-        if user:
-            main = self.stacked_widget.main_window
-            main.current_user = user
+        main = self.stacked_widget.main_window
+        main.current_user = user
 
-            main.update_profile()
-            main.load_contacts()
-            self.stacked_widget.setCurrentIndex(2)
+        main.update_profile()
+        main.load_contacts()
+        self.stacked_widget.setCurrentIndex(2)
 
-        else:
-            QMessageBox.warning(self, "Error", "Invalid credentials")
+    def show_login_error(self, message):
+        self.login_btn.setEnabled(True)
+        self.stacked_widget.main_window.disconnect_from_server()
+        QMessageBox.warning(self, "Error", message)
 
 
 class SignupWindow(QWidget):
@@ -295,18 +1288,19 @@ class SignupWindow(QWidget):
             QMessageBox.warning(self, "Error", "Passwords don't match")
             return
 
-        session = Session()
-        if session.query(User).filter_by(username=username).first():
+        if DIRECTORY.find(username=username):
             QMessageBox.warning(self, "Error", "Username already exists")
             return
 
-        if session.query(User).filter_by(phone=phone).first():
+        if DIRECTORY.find(phone=phone):
             QMessageBox.warning(self, "Error", "Phone number already registered")
             return
 
-        new_user = User(phone=phone, username=username, password=password)
+        session = Session()
+        new_user = User(phone=phone, username=username, password=hash_password(password))
         session.add(new_user)
         session.commit()
+        DIRECTORY.update(new_user)
         QMessageBox.information(self, "Success", "Account created!")
         self.stacked_widget.setCurrentIndex(0)
 
@@ -316,6 +1310,9 @@ class MainWindow(QMainWindow):
         super().__init__()
         self.stacked_widget = stacked_widget
         self.current_user = None
+        self.client = None
+        self.online_contacts = set()
+        self.contact_names = {}
         self.initUI()
 
     def initUI(self):
@@ -381,40 +1378,113 @@ class MainWindow(QMainWindow):
         session = Session()
         contacts = session.query(Contact).filter_by(user_id=self.current_user.id).all()
         for contact in contacts:
-            user = session.query(User).get(contact.contact_id)
-            item = QListWidgetItem(user.username)
+            user = DIRECTORY.get(contact.contact_id)
+            self.contact_names[user.id] = user.username
+            item = QListWidgetItem(self.contact_label(user.id))
             item.setData(Qt.ItemDataRole.UserRole, user.id)
             self.contacts_list.addItem(item)
 
+    def contact_label(self, contact_id):
+        name = self.contact_names.get(contact_id, "")
+        return f"🟢 {name}" if contact_id in self.online_contacts else name
+
+    def connect_to_server(self, client):
+        self.disconnect_from_server()
+        self.client = client
+        self.client.frame_received.connect(self.handle_frame)
+        self.client.session_rejected.connect(self.session_expired)
+        self.client.start()
+
+    def disconnect_from_server(self):
+        if self.client is not None:
+            self.client.stop()
+            self.client = None
+
+    def session_expired(self):
+        self.disconnect_from_server()
+        QMessageBox.warning(self, "Session expired", "Your session has expired. Please sign in again.")
+
+        while self.stacked_content.count() > 1:
+            chat_window = self.stacked_content.widget(1)
+            self.stacked_content.removeWidget(chat_window)
+            chat_window.deleteLater()
+        self.contacts_list.clear()
+        self.online_contacts.clear()
+        self.current_user = None
+        self.stacked_widget.setCurrentIndex(0)
+
+    def handle_frame(self, sender_id, msg_type, content):
+        if msg_type == 'presence':
+            if content == 'online':
+                self.online_contacts.add(sender_id)
+            else:
+                self.online_contacts.discard(sender_id)
+            for i in range(self.contacts_list.count()):
+                item = self.contacts_list.item(i)
+                if item.data(Qt.ItemDataRole.UserRole) == sender_id:
+                    item.setText(self.contact_label(sender_id))
+            return
+
+        if msg_type == 'busy':
+            self.statusBar().showMessage("Server is busy, retrying message...")
+            return
+
+        if msg_type == 'flow':
+            status = {
+                'pause': "Sending paused by server",
+                'disconnected': "Disconnected, messages will be sent after reconnecting",
+            }.get(content)
+            if status:
+                self.statusBar().showMessage(status)
+            else:
+                self.statusBar().clearMessage()
+            return
+
+        for i in range(1, self.stacked_content.count()):
+            chat_window = self.stacked_content.widget(i)
+            if chat_window.contact_id != sender_id:
+                continue
+            if msg_type == 'typing':
+                chat_window.show_typing(content)
+            elif msg_type == 'read':
+                chat_window.show_read(int(content))
+            elif msg_type == 'stored':
+                chat_window.message_sent(int(content.split(':', 1)[1]))
+            elif msg_type == 'failed':
+                chat_window.status_label.setText("Message could not be sent")
+            elif msg_type in MESSAGE_TYPES:
+                message_id, content = content.split(':', 1)
+                chat_window.receive_message(int(message_id), msg_type, content)
+
     def open_settings(self):
-        settings_dialog = SettingsDialog(self.current_user, self)
+        settings_dialog = SettingsDialog(self.current_user, self.client, self)
         settings_dialog.exec()
         self.update_profile()
 
     def open_add_contact(self):
-        add_dialog = AddContactDialog(self.current_user, self)
+        add_dialog = AddContactDialog(self.current_user, self.client, self)
         add_dialog.exec()
         self.load_contacts()
 
     def open_chat(self, item):
         contact_id = item.data(Qt.ItemDataRole.UserRole)
-        session = Session()
-        contact = session.query(User).get(contact_id)
+        contact = DIRECTORY.get(contact_id)
 
         for i in range(1, self.stacked_content.count()):
             if self.stacked_content.widget(i).contact_id == contact_id:
                 self.stacked_content.setCurrentIndex(i)
                 return
 
-        chat_window = ChatWindow(self.current_user, contact)
+        chat_window = ChatWindow(self.current_user, contact, self.client)
         self.stacked_content.addWidget(chat_window)
         self.stacked_content.setCurrentIndex(self.stacked_content.count() - 1)
 
 
 class SettingsDialog(QDialog):
-    def __init__(self, user, parent=None):
+    def __init__(self, user, client=None, parent=None):
         super().__init__(parent)
         self.user = user
+        self.client = client
         self.initUI()
 
     def initUI(self):
@@ -487,15 +1557,13 @@ class SettingsDialog(QDialog):
             QMessageBox.warning(self, "Error", "Username cannot be empty")
             return
 
-        session = Session()
-
         if new_username != self.user.username:
-            if session.query(User).filter_by(username=new_username).first():
+            if DIRECTORY.find(username=new_username):
                 QMessageBox.warning(self, "Error", "Username already exists")
                 return
 
         if new_phone != self.user.phone:
-            if session.query(User).filter_by(phone=new_phone).first():
+            if DIRECTORY.find(phone=new_phone):
                 QMessageBox.warning(self, "Error", "Phone number already exists")
                 return
 
@@ -506,17 +1574,24 @@ class SettingsDialog(QDialog):
         self.user.username = new_username
         self.user.phone = new_phone
         if new_password:
-            self.user.password = new_password
+            self.user.password = hash_password(new_password)
 
+        session = Session()
+        session.merge(self.user)
         session.commit()
+        DIRECTORY.update(self.user)
+        if new_password and self.client:
+            # Tokens signed with the old password no longer verify; ask for a new one
+            self.client.change_password(new_password)
         QMessageBox.information(self, "Success", "Profile updated!")
         self.accept()
 
 
 class AddContactDialog(QDialog):
-    def __init__(self, user, parent=None):
+    def __init__(self, user, client=None, parent=None):
         super().__init__(parent)
         self.user = user
+        self.client = client
         self.initUI()
 
     def initUI(self):
@@ -527,20 +1602,41 @@ class AddContactDialog(QDialog):
 
         self.username_input = QLineEdit()
         self.username_input.setPlaceholderText("Username")
+        self.username_input.textEdited.connect(self.update_suggestions)
         form.addRow("Username:", self.username_input)
 
         self.phone_input = QLineEdit()
         self.phone_input.setPlaceholderText("Phone Number")
+        self.phone_input.textEdited.connect(self.update_suggestions)
         form.addRow("Phone:", self.phone_input)
 
         layout.addLayout(form)
 
+        self.suggestions = QListWidget()
+        self.suggestions.itemClicked.connect(self.select_suggestion)
+        layout.addWidget(self.suggestions)
+
         self.add_btn = QPushButton("Add Contact")
         self.add_btn.clicked.connect(self.add_contact)
         layout.addWidget(self.add_btn)
 
         self.setLayout(layout)
 
+    def update_suggestions(self, text):
+        self.suggestions.clear()
+        if not text:
+            return
+        for user_id, username, phone in DIRECTORY.search(text):
+            if user_id == self.user.id:
+                continue
+            item = QListWidgetItem(f"{username} ({phone})")
+            item.setData(Qt.ItemDataRole.UserRole, username)
+            self.suggestions.addItem(item)
+
+    def select_suggestion(self, item):
+        self.username_input.setText(item.data(Qt.ItemDataRole.UserRole))
+        self.phone_input.clear()
+
     def add_contact(self):
         username = self.username_input.text()
         phone = self.phone_input.text()
@@ -549,13 +1645,12 @@ class AddContactDialog(QDialog):
             QMessageBox.warning(self, "Error", "Enter username or phone")
             return
 
-        session = Session()
         contact = None
 
         if username:
-            contact = session.query(User).filter_by(username=username).first()
+            contact = DIRECTORY.find(username=username)
         elif phone:
-            contact = session.query(User).filter_by(phone=phone).first()
+            contact = DIRECTORY.find(phone=phone)
 
         if not contact:
             QMessageBox.warning(self, "Error", "User not found")
@@ -565,6 +1660,7 @@ class AddContactDialog(QDialog):
             QMessageBox.warning(self, "Error", "You can't add yourself")
             return
 
+        session = Session()
         existing = session.query(Contact).filter_by(
             user_id=self.user.id,
             contact_id=contact.id
@@ -577,15 +1673,23 @@ class AddContactDialog(QDialog):
         new_contact = Contact(user_id=self.user.id, contact_id=contact.id)
         session.add(new_contact)
         session.commit()
+        if self.client:
+            # Lets the server start sending this contact's presence right away
+            self.client.send_frame(contact.id, 'contact', 'added')
         QMessageBox.information(self, "Success", "Contact added!")
         self.accept()
 
 class ChatWindow(QWidget):
-    def __init__(self, user, contact, parent=None):
+    def __init__(self, user, contact, client=None, parent=None):
         super().__init__(parent)
         self.user = user
         self.contact = contact
         self.contact_id = contact.id
+        self.client = client
+        self.last_typing_sent = 0
+        self.last_sent_id = 0
+        self.pending_read_id = 0
+        self.last_read_sent = 0
         self.initUI()
         self.load_messages()
 
@@ -596,8 +1700,21 @@ class ChatWindow(QWidget):
         self.contact_name = QLabel(self.contact.username)
         self.contact_name.setFont(QFont("Arial", 14))
         header.addWidget(self.contact_name)
+
+        self.status_label = QLabel()
+        self.status_label.setAlignment(Qt.AlignmentFlag.AlignRight)
+        header.addWidget(self.status_label)
         layout.addLayout(header)
 
+        self.typing_timer = QTimer(self)
+        self.typing_timer.setSingleShot(True)
+        self.typing_timer.timeout.connect(self.status_label.clear)
+
+        # Receipts are debounced to the newest message and only sent while this chat is on screen
+        self.read_timer = QTimer(self)
+        self.read_timer.setSingleShot(True)
+        self.read_timer.timeout.connect(self.send_read)
+
         self.message_display = QTextEdit()
         self.message_display.setReadOnly(True)
         layout.addWidget(self.message_display)
@@ -606,6 +1723,7 @@ class ChatWindow(QWidget):
 
         self.message_input = QLineEdit()
         self.message_input.setPlaceholderText("Type a message...")
+        self.message_input.textEdited.connect(self.send_typing)
         input_layout.addWidget(self.message_input)
 
         self.send_btn = QPushButton("Send")
@@ -637,9 +1755,13 @@ class ChatWindow(QWidget):
 
         for msg in messages:
             self.display_message(msg)
+            if msg.sender_id == self.contact.id:
+                self.pending_read_id = msg.id
+            else:
+                self.last_sent_id = msg.id
 
     def display_message(self, message):
-        sender = "You" if message.sender_id == self.user.id else self.contact.username
+        sender = "You" if message.sender_id == self.user.id else DIRECTORY.get(message.sender_id).username
         content = message.content
 
         if message.file_type == 'sticker':
@@ -651,24 +1773,83 @@ class ChatWindow(QWidget):
 
         self.message_display.append(f"<b>{sender}:</b> {content}")
 
+    def send_message(self, msg_type, content):
+        if not self.client:
+            QMessageBox.warning(self, "Error", "Not connected to the server")
+            return False
+        # Leave room for the frame header so the server doesn't drop the connection
+        if len(content.encode()) > MAX_FRAME_SIZE - 256:
+            QMessageBox.warning(self, "Error", "Message is too long")
+            return False
+        self.client.send_message(self.contact.id, msg_type, content)
+        return True
+
     def send_text_message(self):
         text = self.message_input.text().strip()
         if not text:
             return
 
-        session = Session()
-        new_message = Message(
-            sender_id=self.user.id,
-            receiver_id=self.contact.id,
-            content=text,
-            file_type='text'
-        )
-        session.add(new_message)
-        session.commit()
+        if not self.send_message('text', text):
+            return
 
         self.message_display.append(f"<b>You:</b> {text}")
         self.message_input.clear()
 
+        if self.client and self.last_typing_sent:
+            self.client.send_frame(self.contact.id, 'typing', 'stop')
+            self.last_typing_sent = 0
+
+    def send_typing(self):
+        # Throttled locally as well so keystrokes don't each become a frame
+        now = time.monotonic()
+        if not self.client or now - self.last_typing_sent < TYPING_INTERVAL:
+            return
+        self.last_typing_sent = now
+        self.client.send_frame(self.contact.id, 'typing', 'start')
+
+    def show_typing(self, state):
+        if state == 'stop':
+            self.typing_timer.stop()
+            self.status_label.clear()
+            return
+        self.status_label.setText(f"{self.contact.username} is typing...")
+        self.typing_timer.start(int(TYPING_INTERVAL * 1000) * 2)
+
+    def receive_message(self, message_id, msg_type, content):
+        message = Message(
+            id=message_id,
+            sender_id=self.contact.id,
+            receiver_id=self.user.id,
+            content=content,
+            file_type=msg_type
+        )
+        self.display_message(message)
+        self.typing_timer.stop()
+        self.status_label.clear()
+        self.pending_read_id = max(self.pending_read_id, message_id)
+        if not self.read_timer.isActive():
+            self.read_timer.start(int(RECEIPT_INTERVAL * 1000))
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.read_timer.start(int(RECEIPT_INTERVAL * 1000))
+
+    def send_read(self):
+        if not self.client or not self.isVisible() or self.pending_read_id <= self.last_read_sent:
+            return
+        self.client.send_frame(self.contact.id, 'read', self.pending_read_id)
+        self.last_read_sent = self.pending_read_id
+
+    def message_sent(self, message_id):
+        self.last_sent_id = max(self.last_sent_id, message_id)
+        if self.status_label.text() == "Seen":
+            self.status_label.clear()
+
+    def show_read(self, message_id):
+        if self.last_sent_id and message_id >= self.last_sent_id:
+            self.typing_timer.stop()
+            self.status_label.setText("Seen")
+
     def attach_file(self):
         file_path, _ = QFileDialog.getOpenFileName(
             self,
@@ -679,15 +1860,8 @@ class ChatWindow(QWidget):
         if file_path:
             file_name = os.path.basename(file_path)
 
-            session = Session()
-            new_message = Message(
-                sender_id=self.user.id,
-                receiver_id=self.contact.id,
-                content=file_name,
-                file_type='file'
-            )
-            session.add(new_message)
-            session.commit()
+            if not self.send_message('file', file_name):
+                return
 
             self.message_display.append(f"<b>You:</b> 📄 File: {file_name}")
 
@@ -696,15 +1870,8 @@ class ChatWindow(QWidget):
         if sticker_dialog.exec():
             sticker_path = sticker_dialog.selected_sticker
 
-            session = Session()
-            new_message = Message(
-                sender_id=self.user.id,
-                receiver_id=self.contact.id,
-                content=sticker_path,
-                file_type='sticker'
-            )
-            session.add(new_message)
-            session.commit()
+            if not self.send_message('sticker', sticker_path):
+                return
 
             self.message_display.append(f"<b>You:</b> <img src='{sticker_path}' width='100' />")
 
@@ -713,15 +1880,8 @@ class ChatWindow(QWidget):
         QMessageBox.information(self, "Voice Message", "Voice recording started...")
         time.sleep(2)  # Simulate recording
 
-        session = Session()
-        new_message = Message(
-            sender_id=self.user.id,
-            receiver_id=self.contact.id,
-            content="voice_note.wav",
-            file_type='voice'
-        )
-        session.add(new_message)
-        session.commit()
+        if not self.send_message('voice', "voice_note.wav"):
+            return
 
         self.message_display.append(f"<b>You:</b> 🔊 Voice message")
 
@@ -771,12 +1931,17 @@ class MessengerApp(QApplication):
         self.login_window.stacked_widget = self.stacked_widget
         self.signup_window.stacked_widget = self.stacked_widget
         self.stacked_widget.main_window = self.main_window
+        self.aboutToQuit.connect(self.main_window.disconnect_from_server)
 
         self.stacked_widget.show()
 
 
 # ====================== RUN APPLICATION ======================
 if __name__ == "__main__":
+    if "--bench-tls" in sys.argv:
+        benchmark_tls_reconnect()
+        sys.exit()
+
     server_thread = threading.Thread(target=MessengerServer().start, daemon=True)
     server_thread.start()
 